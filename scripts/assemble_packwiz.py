@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import json
-import os
 import re
 import shutil
 import subprocess
+import tomllib
+from pathlib import Path
 from typing import Any, TypeAlias, TypedDict
 
 import common
@@ -16,18 +17,21 @@ def main():
     source_pack = repo_root / "pack"
     dest_pack = common.get_generated_dir() / "pack"
     exclude_file = repo_root / "platform.ignore"
-    packwiz = common.check_packwiz()
 
     common.fix_packwiz_pack(source_pack / "pack.toml")
+    locked_data = load_normalized_lock(submission_lock_file)
+    assemble(source_pack, dest_pack, locked_data, read_exclusions(exclude_file))
+
+def assemble(source_pack: Path, dest_pack: Path, locked_data: "SubmissionLockfileFormat", exclusions: list[str], remove: list[str] = [], side: str | None = None):
+    """Creates a packwiz pack in dest_pack out of source_pack and all submissions. Files in
+    remove (relative to the pack) are left out, and if side is set only files needed on that side are kept"""
+    packwiz = common.check_packwiz()
 
     if dest_pack.exists():
         shutil.rmtree(dest_pack)
     shutil.copytree(source_pack, dest_pack)
     common.fix_packwiz_pack(dest_pack / "pack.toml")
 
-    exclusions = list(filter(lambda l : len(l) > 0, [re.sub("#.*", "", l.strip()) for l in common.read_file(exclude_file).split("\n")]))
-
-    locked_data: SubmissionLockfileFormat = json.loads(common.read_file(submission_lock_file))
     for platformid, moddata in locked_data.items():
         if not "files" in moddata:
             raise RuntimeError(f"lock data for {platformid} is invalid. Does not contain file key")
@@ -40,7 +44,7 @@ def main():
             dst_file = dest_pack / "mods" / filename
             if not dst_file.exists():
                 # We want all mods to be on both sides for singleplayer compat
-                filedata["side"] = "both"
+                filedata = filedata | {"side": "both"}
                 with open(dst_file, "w") as f:
                     f.write(tomli_w.dumps(filedata))
 
@@ -48,8 +52,48 @@ def main():
         if not e in locked_data:
             raise Exception(f"{e} was given as an exclusion, but does not actually appear in the submission data. Was it a typo?")
 
-    os.chdir(dest_pack)
-    subprocess.run([packwiz, "refresh"])
+    for r in remove:
+        if not (dest_pack / r).exists():
+            raise Exception(f"{r} was marked to be removed, but does not exist in the pack. Was it a typo?")
+        (dest_pack / r).unlink()
+    if side is not None:
+        for metafile in dest_pack.rglob("*.pw.toml"):
+            if tomllib.loads(common.read_file(metafile)).get("side", "both") not in ["both", side]:
+                metafile.unlink()
+
+    subprocess.run([packwiz, "refresh"], cwd=dest_pack)
+
+def read_exclusions(exclude_file) -> list[str]:
+    return parse_exclusions(common.read_file(exclude_file))
+
+def parse_exclusions(content: str) -> list[str]:
+    return list(filter(lambda l : len(l) > 0, [re.sub("#.*", "", l.strip()) for l in content.split("\n")]))
+
+# The lock file contains the dependencies of each submission as resolved by packwiz. Shared dependencies
+# are reconciled by dependency_graph.py, which writes the result to a separate file. Only that file is used
+# for assembling the pack, while the lock file stays as a cache for pull_platform.py
+def normalized_lock_file(lock_file: Path) -> Path:
+    return lock_file.with_name(lock_file.name.removesuffix(".json") + ".normalized.json")
+
+def write_normalized_lock(lock_file: Path, normalized: "SubmissionLockfileFormat"):
+    data = {
+        # Used to detect if the lock file was changed without updating the normalized lock
+        "lock_hash": common.hash([common.read_file(lock_file)]),
+        "submissions": normalized
+    }
+    common.write_file_atomic(normalized_lock_file(lock_file), json.dumps(data, indent=2, sort_keys=True))
+
+def load_normalized_lock(lock_file: Path) -> "SubmissionLockfileFormat":
+    raw = common.read_file(lock_file)
+    normalized_file = normalized_lock_file(lock_file)
+    if not normalized_file.exists():
+        if len(json.loads(raw)) == 0:
+            return {}
+        raise RuntimeError(f"{normalized_file.name} does not exist. Please run scripts/dependency_graph.py")
+    normalized = json.loads(common.read_file(normalized_file))
+    if normalized["lock_hash"] != common.hash([raw]):
+        raise RuntimeError(f"{normalized_file.name} is out of date with {lock_file.name}. Please run scripts/dependency_graph.py")
+    return normalized["submissions"]
 
 if __name__ == "__main__":
     main()
@@ -57,5 +101,6 @@ if __name__ == "__main__":
 # For type hints
 class SubmissionLockfileEntry(TypedDict):
     url: str 
+    main: str | None # Name of the submission's own metafile, if packwiz installed it
     files: dict[str, Any]
 SubmissionLockfileFormat: TypeAlias = dict[str, SubmissionLockfileEntry]
\ No newline at end of file
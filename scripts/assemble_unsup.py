@@ -3,8 +3,10 @@ import io
 import json
 import re
 import sys
+import threading
 import urllib.request
 import zipfile
+from pathlib import Path
 from typing import Any
 from zipfile import ZipFile
 
@@ -28,21 +30,23 @@ def main():
 
     print(f"Using unsup version {unsup_v}")
     
-    packwiz_info = common.parse_packwiz(pack_toml_file)
     constants = common.jsonc_at_home(common.read_file(constants_file))
+    build_zips(pack_toml_file, constants, url, unsup_v, generated_dir, generated_dir / "cache")
+
+def build_zips(pack_toml_file: Path, constants: Any, url: str, unsup_v: str, output_dir: Path, cache_dir: Path):
+    """Creates the prism and server zips in output_dir. Downloaded files are stored in cache_dir"""
+    packwiz_info = common.parse_packwiz(pack_toml_file)
 
     # Download unsup jar
-    unsup_jar_file = generated_dir / "cache" / f"unsup-{unsup_v}.jar"
-    if not unsup_jar_file.exists():
-        unsup_jar_file.parent.mkdir(exist_ok=True, parents=True)
-        print(f"Downloading unsup to {unsup_jar_file.relative_to(repo_root)}")
-        urllib.request.urlretrieve(
-            f"https://repo.sleeping.town/com/unascribed/unsup/{unsup_v}/unsup-{unsup_v}.jar",
-            unsup_jar_file
-        )
+    unsup_jar_file = cache_dir / f"unsup-{unsup_v}.jar"
+    download_cached(f"https://repo.sleeping.town/com/unascribed/unsup/{unsup_v}/unsup-{unsup_v}.jar", unsup_jar_file)
+
+    art_id = constants["art_id"]
+    icon_file = cache_dir / f"icon-{art_id}.png"
+    download_cached(f'https://github.com/ModFest/art/blob/v2/icon/64w/{art_id}/transparent.png?raw=true', icon_file)
 
     # Create prism zip
-    prism = generated_dir / f"{packwiz_info.name}.zip"
+    prism = output_dir / f"{packwiz_info.name}.zip"
     with ZipFile(prism, "w", compression=zipfile.ZIP_DEFLATED) as output_zip:
         icon_key = packwiz_info.safe_name()
 
@@ -52,9 +56,8 @@ def main():
         with output_zip.open("mmc-pack.json", mode="w") as packjson:
             packjson.write(create_mmc_meta(packwiz_info, unsup_v).encode("utf-8"))
         
-        art_id = constants["art_id"]
-        with urllib.request.urlopen(f'https://github.com/ModFest/art/blob/v2/icon/64w/{art_id}/transparent.png?raw=true') as icon:
-            with output_zip.open(f"{icon_key}.png", mode="w") as icon_out:
+        with output_zip.open(f"{icon_key}.png", mode="w") as icon_out:
+            with open(icon_file, "rb") as icon:
                 icon_out.write(icon.read())
 
         with output_zip.open("patches/com.unascribed.unsup.json", mode="w") as patch:
@@ -66,9 +69,9 @@ def main():
 
         with output_zip.open(".minecraft/unsup.ini", mode="w") as unsupini:
             unsupini.write(create_unsup_ini(url, constants).encode("utf-8"))
-    print(f"Wrote to \"{prism.relative_to(generated_dir)}\"")
+    print(f"Wrote to \"{prism.relative_to(output_dir)}\"")
 
-    server_zip = generated_dir / f"{packwiz_info.safe_name()}-server.zip"
+    server_zip = output_dir / f"{packwiz_info.safe_name()}-server.zip"
     with ZipFile(server_zip, "w", compression=zipfile.ZIP_DEFLATED) as output_zip:
         if packwiz_info.loader == "fabric":
             print(f"{Ansi.WARN}Fabric server zips are not supported yet{Ansi.RESET}")
@@ -82,7 +85,20 @@ def main():
 
         with output_zip.open("unsup.ini", mode="w") as unsupini:
             unsupini.write(create_unsup_ini(url, constants).encode("utf-8"))
-    print(f"Wrote to \"{server_zip.relative_to(generated_dir)}\"")
+    print(f"Wrote to \"{server_zip.relative_to(output_dir)}\"")
+
+# Several packs can be built at the same time, this prevents them from downloading the same file twice
+download_lock = threading.Lock()
+
+def download_cached(url: str, file: Path):
+    with download_lock:
+        if not file.exists():
+            file.parent.mkdir(exist_ok=True, parents=True)
+            print(f"Downloading {url} to {file}")
+            # Download to a temporary file first, so a failed download doesn't end up in the cache
+            tmp = file.with_name(file.name + ".tmp")
+            urllib.request.urlretrieve(url, tmp)
+            tmp.replace(file)
 
 # Creates a patch file which tells prism to
 # load unsup as an agent
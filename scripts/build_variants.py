@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Builds every pack variant defined in variants.jsonc (or the file in VARIANTS_FILE).
+# Each variant ends up in generated/<variant>/
+import graphlib
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, TypedDict
+
+import assemble_packwiz
+import assemble_unsup
+import common
+from common import Ansi
+
+
+class Variant(TypedDict, total=False):
+    pack: str # Source packwiz directory, relative to the repo root. Defaults to "pack"
+    base: str # Name of another variant whose output is used as the source instead
+    constants: str
+    lock: str
+    exclusions: str
+    exclude: list[str] # Submissions to leave out, on top of the ones in the exclusions file
+    remove: list[str] # Files to remove from the pack, relative to the pack
+    side: str # If set, only files needed on this side are kept
+    url: str # Public url of the variant's pack.toml. The unsup zips are only created if this is set
+
+def main():
+    repo_root = common.get_repo_root()
+    variants_file = Path(common.env("VARIANTS_FILE", default=(repo_root / "variants.jsonc")))
+    generated_dir = common.get_generated_dir()
+    jobs = int(common.env("VARIANT_JOBS", default=(os.cpu_count() or 1)))
+    unsup_v = common.env("UNSUP_VERSION", default="0.2.3")
+
+    variants: dict[str, Variant] = common.jsonc_at_home(common.read_file(variants_file))
+    graph = {}
+    for name, variant in variants.items():
+        if "base" in variant:
+            if variant["base"] not in variants:
+                raise RuntimeError(f"Variant {name} is based on {variant['base']}, which doesn't exist")
+            for key in ["pack", "lock", "exclusions", "exclude"]:
+                if key in variant:
+                    raise RuntimeError(f"Variant {name} has a base, so it can't define \"{key}\". Its submissions are taken from the base")
+            graph[name] = {variant["base"]}
+        else:
+            common.fix_packwiz_pack(repo_root / variant.get("pack", "pack") / "pack.toml")
+            graph[name] = set()
+
+    shared = SharedData()
+    sorter = graphlib.TopologicalSorter(graph)
+    sorter.prepare() # Throws if variants are based on each other in a cycle
+
+    # Variants are built as soon as the variant they're based on is done
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running: dict[Future, str] = {}
+        while sorter.is_active():
+            for name in sorter.get_ready():
+                print(f"Building variant {name}")
+                running[executor.submit(build_variant, name, variants[name], repo_root, generated_dir, unsup_v, shared)] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                future.result()
+                print(f"Finished variant {name}")
+                sorter.done(name)
+
+def build_variant(name: str, variant: Variant, repo_root: Path, generated_dir: Path, unsup_v: str, shared: "SharedData"):
+    output_dir = generated_dir / name
+    output_dir.mkdir(exist_ok=True, parents=True)
+    dest_pack = output_dir / "pack"
+
+    if "base" in variant:
+        source_pack = generated_dir / variant["base"] / "pack"
+        # The base already contains all submissions
+        locked_data = {}
+        exclusions = []
+    else:
+        source_pack = repo_root / variant.get("pack", "pack")
+        lock_file = repo_root / variant.get("lock", "submissions-lock.json")
+        locked_data = shared.load(lock_file, lambda _: assemble_packwiz.load_normalized_lock(lock_file))
+        exclusions = shared.load(repo_root / variant.get("exclusions", "platform.ignore"), assemble_packwiz.parse_exclusions) + variant.get("exclude", [])
+    assemble_packwiz.assemble(source_pack, dest_pack, locked_data, exclusions, variant.get("remove", []), variant.get("side"))
+
+    if url := variant.get("url"):
+        constants = shared.load(repo_root / variant.get("constants", "constants.jsonc"), common.jsonc_at_home)
+        assemble_unsup.build_zips(dest_pack / "pack.toml", constants, url, unsup_v, output_dir, generated_dir / "cache")
+    else:
+        print(f"{Ansi.WARN}Variant {name} doesn't define a url, not creating unsup zips{Ansi.RESET}")
+
+class SharedData:
+    """Parsed files which are used by multiple variants. Each file is only read once"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parsed: dict[Path, Any] = {}
+
+    def load(self, file: Path, parser: Callable[[str], Any]) -> Any:
+        file = file.resolve()
+        with self.lock:
+            if file not in self.parsed:
+                self.parsed[file] = parser(common.read_file(file))
+            return self.parsed[file]
+
+if __name__ == "__main__":
+    main()
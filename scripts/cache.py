@@ -0,0 +1,164 @@
+import json
+import os
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Any, Callable
+
+import common
+from common import Ansi
+
+# This is nice to store, for if we ever make breaking changes
+CACHE_SCRIPT_VERSION = 1
+
+@dataclass
+class CacheComponent:
+    name: str # Key used in the state file
+    description: str # Human-readable name used in messages
+    directory: Path
+    # Installs the component into the (empty) directory. Receives the directory, the desired state and the context passed to ensure_all
+    install: Callable[[Path, str, Any], None]
+    # Checks the installed component, returns an error message if something is wrong with it
+    validate: Callable[[Path, Any], str | None]
+    # Other directories which should be deleted whenever this component is
+    dependents: list[Path] = field(default_factory=list)
+
+class CacheRegistry:
+    """Keeps track of the installed version of each cached component, using a state file"""
+    def __init__(self, state_file: Path, roots: list[Path]):
+        self.state_file = state_file
+        self.roots = roots # Directories which only contain cache entries
+        self.components: dict[str, CacheComponent] = {}
+        self.unmanaged: dict[str, Path] = {} # Cache entries which are kept up to date by other programs
+
+    def register(self, component: CacheComponent):
+        self.components[component.name] = component
+
+    def keep(self, name: str, path: Path):
+        """Marks a path as being a cache entry, even if it's not managed by this registry"""
+        self.unmanaged[name] = path
+
+    def read_state(self) -> dict[str, Any]:
+        if not self.state_file.exists():
+            return {}
+        try:
+            return json.loads(common.read_file(self.state_file))
+        except Exception:
+            print(f"Failed to load cache state, ignoring it")
+            return {}
+
+    def save_state(self, state: dict[str, Any], file: Path | None = None):
+        state["script_version"] = CACHE_SCRIPT_VERSION
+        file = file or self.state_file
+        file.parent.mkdir(exist_ok=True, parents=True)
+        common.write_file_atomic(file, json.dumps(state, sort_keys=True))
+
+    def ensure_all(self, desired_state: dict[str, str], context: Any):
+        """Makes sure every component is installed and matches the desired state"""
+        state = self.read_state()
+        for name, component in self.components.items():
+            self.ensure(component, desired_state[name], state, context)
+
+    def ensure(self, component: CacheComponent, desired: str, state: dict[str, Any], context: Any):
+        if state.get(component.name) == None:
+            # Nothing (complete) is installed. Clear out whatever might be left over
+            self.invalidate(component, state)
+        elif desired != state.get(component.name):
+            print(f"Cached {component.description} is stale. Deleting it.")
+            self.invalidate(component, state)
+        elif err := component.validate(component.directory, context):
+            print(f"{Ansi.WARN}Something is wrong with the cached {component.description}:{Ansi.RESET} {err}")
+            self.invalidate(component, state)
+
+        if state.get(component.name) == None:
+            component.directory.mkdir(exist_ok=True, parents=True)
+            component.install(component.directory, desired, context)
+            # Update cache state to reflect the newly installed component
+            state[component.name] = desired
+            self.save_state(state)
+        else:
+            print(f"Cache hit: {component.description} ({desired}) is in the cache")
+
+    def invalidate(self, component: CacheComponent, state: dict[str, Any]):
+        # Mark the component as missing before deleting anything, so a crash halfway through can't leave a half-deleted component behind
+        state[component.name] = None
+        self.save_state(state)
+        for directory in [component.directory] + component.dependents:
+            if directory.exists():
+                shutil.rmtree(directory)
+
+    def usage(self) -> dict[str, int]:
+        """Size of each cache entry in bytes"""
+        sizes = {name: dir_size(c.directory) for name, c in self.components.items()}
+        for name, path in self.unmanaged.items():
+            sizes[name] = dir_size(path)
+        return sizes
+
+    def print_usage(self):
+        sizes = self.usage()
+        entries = [f"{name} {common.format_size(size)}" for name, size in sizes.items()]
+        print(f"Cache usage: {common.format_size(sum(sizes.values()))} ({', '.join(entries)})")
+
+    def gc(self) -> int:
+        """Removes anything in the cache which isn't known to the registry. Returns the amount of bytes freed"""
+        state = self.read_state()
+        known = {self.state_file} | set(self.unmanaged.values())
+        for name, component in self.components.items():
+            # Components which were never installed (or whose install was interrupted) can't be trusted
+            if state.get(name) == None and component.directory.exists():
+                print(f"Removing incomplete {component.description}")
+                state[name] = None
+            else:
+                known.add(component.directory)
+                known.update(component.dependents)
+
+        freed = 0
+        for root in self.roots:
+            if not root.exists():
+                continue
+            for entry in root.iterdir():
+                if entry in known:
+                    continue
+                size = dir_size(entry)
+                print(f"Removing orphaned cache entry {entry} ({common.format_size(size)})")
+                if entry.is_dir() and not entry.is_symlink():
+                    shutil.rmtree(entry)
+                else:
+                    entry.unlink()
+                freed += size
+
+        orphaned_keys = [k for k in state if k != "script_version" and k not in self.components]
+        for k in orphaned_keys:
+            print(f"Removing orphaned cache state for {k}")
+            del state[k]
+        if self.state_file.exists():
+            self.save_state({k: v for k, v in state.items() if v is not None})
+        return freed
+
+def lock_work_dir(work_dir: Path) -> IO[Any]:
+    """Takes an exclusive lock on the work dir, blocking until it's available. The lock is held until the returned file is closed or the process exits"""
+    work_dir.mkdir(exist_ok=True, parents=True)
+    lock_file = open(work_dir / ".lock", "w")
+    try:
+        import fcntl
+    except ImportError:
+        print(f"{Ansi.WARN}File locking isn't supported on this platform, make sure only one test runs in {work_dir} at a time{Ansi.RESET}")
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print(f"Waiting for another run to release {work_dir}")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+def dir_size(path: Path) -> int:
+    """Size of a file or directory in bytes. Symlinks are not followed"""
+    if not path.exists():
+        return 0
+    if not path.is_dir() or path.is_symlink():
+        return path.lstat().st_size
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for f in filenames:
+            total += os.lstat(os.path.join(dirpath, f)).st_size
+    return total
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import json
+import sys
+import threading
+import tomllib
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, TypedDict
+
+import assemble_packwiz
+import common
+from common import Ansi
+
+USER_AGENT = "packwiz-setup-url-check"
+
+class UrlStatus(TypedDict):
+    ok: bool
+    status: int | None
+    size: int | None # In bytes, None if the server didn't tell us
+    error: str | None
+    sources: list[str] # Submission ids or pack files which use this url
+
+def main():
+    repo_root = common.get_repo_root()
+    submission_lock_file = repo_root / "submissions-lock.json"
+    source_pack = repo_root / "pack"
+    exclude_file = repo_root / "platform.ignore"
+    report_file = Path(common.env("URL_REPORT", default=(common.get_generated_dir() / "url-health.json")))
+    concurrency = int(common.env("URL_CHECK_CONCURRENCY", default=16))
+    per_host = int(common.env("URL_CHECK_PER_HOST", default=4))
+
+    urls = collect_urls(assemble_packwiz.load_normalized_lock(submission_lock_file), source_pack, assemble_packwiz.read_exclusions(exclude_file))
+    print(f"Checking {len(urls)} urls")
+    results = check_urls(urls, concurrency, per_host)
+
+    previous = json.loads(common.read_file(report_file))["urls"] if report_file.exists() else {}
+    total_size = sum(r["size"] or 0 for r in results.values())
+    unreachable = sorted(url for url, r in results.items() if not r["ok"])
+    size_changes = {
+        url: {"old": previous[url]["size"], "new": r["size"]}
+        for url, r in results.items()
+        if url in previous and previous[url]["size"] is not None and r["size"] is not None and previous[url]["size"] != r["size"]
+    }
+
+    for url in unreachable:
+        r = results[url]
+        print(f"{Ansi.ERROR}Unreachable:{Ansi.RESET} {url} ({r['error']}), used by {', '.join(r['sources'])}")
+    for url, change in size_changes.items():
+        print(f"{Ansi.WARN}Size changed:{Ansi.RESET} {url} went from {change['old']} to {change['new']} bytes")
+    unknown = len([r for r in results.values() if r["ok"] and r["size"] is None])
+    print(f"Total download size: {total_size / (1024 * 1024):.1f}MiB" + (f" (size of {unknown} urls unknown)" if unknown else ""))
+
+    report_file.parent.mkdir(exist_ok=True, parents=True)
+    common.write_file_atomic(report_file, json.dumps({
+        "total_size": total_size,
+        "unreachable": unreachable,
+        "size_changes": size_changes,
+        "urls": results
+    }, indent=2, sort_keys=True))
+    print(f"Wrote report to {report_file}")
+
+    if len(unreachable) > 0:
+        sys.exit(1)
+
+def collect_urls(lock_data: dict[str, Any], pack_dir: Path, exclusions: list[str]) -> dict[str, list[str]]:
+    """Finds all download urls which end up in the assembled pack, and where they're used"""
+    urls: dict[str, list[str]] = {}
+    for platformid, moddata in lock_data.items():
+        if platformid in exclusions:
+            continue
+        for filename, filedata in moddata.get("files", {}).items():
+            # Same as when assembling, the pack takes priority over the locked file
+            if (pack_dir / "mods" / filename).exists():
+                continue
+            urls.setdefault(filedata["download"]["url"], []).append(platformid)
+    for metafile in sorted(pack_dir.rglob("*.pw.toml")):
+        data = tomllib.loads(common.read_file(metafile))
+        if url := data.get("download", {}).get("url"):
+            urls.setdefault(url, []).append(str(metafile.relative_to(pack_dir)))
+    return urls
+
+def check_urls(urls: dict[str, list[str]], concurrency: int, per_host: int, timeout: float = 30) -> dict[str, UrlStatus]:
+    """Checks all urls concurrently, while limiting the amount of concurrent requests to a single host"""
+    host_limits: dict[str, threading.BoundedSemaphore] = {}
+    for url in urls:
+        host = urllib.parse.urlsplit(url).netloc
+        if host not in host_limits:
+            host_limits[host] = threading.BoundedSemaphore(per_host)
+
+    def check(url: str) -> UrlStatus:
+        with host_limits[urllib.parse.urlsplit(url).netloc]:
+            result = check_url(url, timeout)
+        result["sources"] = urls[url]
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return dict(zip(urls, executor.map(check, urls)))
+
+def check_url(url: str, timeout: float) -> UrlStatus:
+    """Checks if a url is reachable and how big the file behind it is. Tries a HEAD request first, falling back to requesting a single byte"""
+    try:
+        with opener.open(urllib.request.Request(url, method="HEAD", headers={"User-Agent": USER_AGENT}), timeout=timeout) as response:
+            length = response.headers.get("Content-Length")
+            if length is not None:
+                return {"ok": True, "status": response.status, "size": int(length), "error": None, "sources": []}
+    except urllib.error.HTTPError as e:
+        # Some servers don't support HEAD, those will be retried using GET
+        if e.code not in [403, 405, 501]:
+            return {"ok": False, "status": e.code, "size": None, "error": str(e.reason), "sources": []}
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        return {"ok": False, "status": None, "size": None, "error": str(e), "sources": []}
+
+    try:
+        request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT, "Range": "bytes=0-0"})
+        with opener.open(request, timeout=timeout) as response:
+            size = None
+            content_range = response.headers.get("Content-Range")
+            if response.status == 206 and content_range is not None and "/" in content_range:
+                total = content_range.rsplit("/", 1)[1]
+                size = int(total) if total.isdigit() else None
+            elif response.status == 200 and (length := response.headers.get("Content-Length")) is not None:
+                # The server ignored the range, we don't need to download the rest to know the size
+                size = int(length)
+            return {"ok": True, "status": response.status, "size": size, "error": None, "sources": []}
+    except urllib.error.HTTPError as e:
+        return {"ok": False, "status": e.code, "size": None, "error": str(e.reason), "sources": []}
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        return {"ok": False, "status": None, "size": None, "error": str(e), "sources": []}
+
+class KeepHeadRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """urllib turns redirected HEAD requests into GET requests, which would download the whole file"""
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new_request = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new_request is not None and req.get_method() == "HEAD":
+            new_request.method = "HEAD"
+        return new_request
+
+opener = urllib.request.build_opener(KeepHeadRedirectHandler)
+
+if __name__ == "__main__":
+    main()
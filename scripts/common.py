@@ -3,6 +3,7 @@ import json
 import os
 import re
 import shutil
+import tempfile
 import time
 import tomllib
 from dataclasses import dataclass
@@ -57,6 +58,27 @@ def read_file(path: os.PathLike) -> str:
     with open(path, "r") as f:
         return f.read()
 
+def write_file_atomic(path: Path, content: str):
+    """Writes a file such that readers will either see the old or the new contents, never a partial write"""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def format_size(size: float) -> str:
+    """Formats a size in bytes as a human-readable string"""
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
 def fix_packwiz_pack(pack_toml: Path):
     data = tomllib.loads(read_file(pack_toml))
     index = pack_toml.parent / data["index"]["file"]
@@ -67,9 +89,9 @@ class JSONWithCommentsDecoder(json.JSONDecoder):
     def __init__(self, **kw):
         super().__init__(**kw)
 
-    def decode(self, s, _w):
+    def decode(self, s, *args):
         s = '\n'.join(l if not l.lstrip().startswith('//') else '' for l in s.split('\n'))
-        return super().decode(s, _w)
+        return super().decode(s, *args)
 
 def jsonc_at_home(input: str | bytes) -> Any:
     return json.loads(input, cls=JSONWithCommentsDecoder)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Reconciles the dependencies of all submissions. Each submission is resolved separately,
+# so shared libraries can end up locked at different versions by different submissions.
+# This picks a single version for each of them and writes the result to submissions-lock.normalized.json,
+# which is what the pack is assembled from.
+import copy
+import graphlib
+import json
+import re
+import sys
+import tomllib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import assemble_packwiz
+import common
+from assemble_packwiz import SubmissionLockfileFormat
+from common import Ansi
+
+
+def main():
+    repo_root = common.get_repo_root()
+    submission_lock_file = repo_root / "submissions-lock.json"
+    source_pack = repo_root / "pack"
+
+    lock_data: SubmissionLockfileFormat = json.loads(common.read_file(submission_lock_file))
+    graph = DependencyGraph(lock_data, source_pack)
+    normalized = graph.normalize()
+    graph.print_report()
+
+    if len(graph.conflicts) > 0:
+        print(f"{Ansi.ERROR}Not updating {assemble_packwiz.normalized_lock_file(submission_lock_file).name} because of the conflicts above{Ansi.RESET}")
+        sys.exit(1)
+    assemble_packwiz.write_normalized_lock(submission_lock_file, normalized)
+
+@dataclass
+class FileNode:
+    """A single packwiz metafile, which might be locked at different versions by different submissions"""
+    name: str
+    # Download hash -> file data
+    variants: dict[str, dict[str, Any]] = field(default_factory=dict)
+    # Download hash -> ids of the submissions which locked that variant
+    users: dict[str, list[str]] = field(default_factory=dict)
+    # Set if the version is fixed, either by the pack or because it's the main file of a submission
+    pinned_by: str | None = None
+    pinned: str | None = None
+
+class DependencyGraph:
+    def __init__(self, lock_data: SubmissionLockfileFormat, pack_dir: Path):
+        self.lock_data = lock_data
+        self.files: dict[str, FileNode] = {}
+        self.conflicts: list[str] = []
+        self.skewed: list[str] = []
+        self.warnings: list[str] = []
+        self.aliases: dict[str, str] = {} # Metafile names which refer to the same download as another metafile
+        # Submission id -> ids of other submissions it depends on
+        self.submission_deps: dict[str, set[str]] = {}
+        self.order: list[str] = []
+
+        pack_files = {}
+        for metafile in (pack_dir / "mods").glob("*.pw.toml"):
+            pack_files[metafile.name] = tomllib.loads(common.read_file(metafile))
+
+        # Files can be renamed by the submission authors, so metafiles which share a download are merged.
+        # Metafiles with the same name are assumed to be the same mod
+        parent: dict[str, str] = {}
+        def find(name: str) -> str:
+            while parent.get(name, name) != name:
+                name = parent[name]
+            return name
+        def union(a: str, b: str):
+            a, b = find(a), find(b)
+            if a != b:
+                # Prefer the name used by the pack, otherwise just be consistent
+                if b in pack_files or (a not in pack_files and b < a):
+                    a, b = b, a
+                parent[b] = a
+        by_hash: dict[str, str] = {}
+        for name, data in sorted(pack_files.items()):
+            by_hash.setdefault(download_hash(data), name)
+        for platformid, moddata in sorted(lock_data.items()):
+            for name, filedata in sorted(moddata["files"].items()):
+                union(by_hash.setdefault(download_hash(filedata), name), name)
+        for name in list(parent):
+            if find(name) != name:
+                self.aliases[name] = find(name)
+
+        for platformid, moddata in sorted(lock_data.items()):
+            for name, filedata in moddata["files"].items():
+                node = self.files.setdefault(self.aliases.get(name, name), FileNode(self.aliases.get(name, name)))
+                h = download_hash(filedata)
+                node.variants[h] = filedata
+                node.users.setdefault(h, []).append(platformid)
+
+        for name, data in pack_files.items():
+            if name in self.files:
+                # The pack always takes priority
+                self.files[name].pinned = download_hash(data)
+                self.files[name].pinned_by = "pack"
+                self.files[name].variants.setdefault(download_hash(data), data)
+
+        # A submission's own file can't be changed, so it pins that file. Other submissions which
+        # include that file depend on the submission
+        owners: dict[str, str] = {}
+        for platformid, moddata in sorted(lock_data.items()):
+            if "main" not in moddata:
+                self.warnings.append(f"The lock data of {platformid} doesn't say which file is its own. Run pull_platform.py to update it")
+                continue
+            name = moddata["main"]
+            if name is None:
+                continue
+            node = self.files[self.aliases.get(name, name)]
+            h = download_hash(moddata["files"][name])
+            if node.pinned is not None and node.pinned != h and node.pinned_by != "pack":
+                self.conflicts.append(f"{node.name} is the main file of both {node.pinned_by} and {platformid}, at different versions")
+            elif node.pinned is None:
+                node.pinned = h
+                node.pinned_by = platformid
+            owners[node.name] = platformid
+        for platformid, moddata in lock_data.items():
+            self.submission_deps[platformid] = set()
+            for name in moddata["files"]:
+                owner = owners.get(self.aliases.get(name, name))
+                if owner is not None and owner != platformid:
+                    self.submission_deps[platformid].add(owner)
+
+    def normalize(self) -> SubmissionLockfileFormat:
+        """Returns the lock data, with every file at a single version"""
+        try:
+            self.order = list(graphlib.TopologicalSorter(self.submission_deps).static_order())
+        except graphlib.CycleError as e:
+            # The order is only used to sort the output, every file still ends up at a single version
+            self.warnings.append(f"Submissions depend on each other in a cycle: {' -> '.join(e.args[1])}")
+            self.order = sorted(self.lock_data.keys())
+
+        chosen: dict[str, str] = {}
+        for node in self.files.values():
+            if node.pinned is not None:
+                chosen[node.name] = node.pinned
+            else:
+                chosen[node.name] = max(node.users, key=lambda h: version_key(node.variants[h]["filename"]))
+            losers = sorted(set(id for h, ids in node.users.items() if h != chosen[node.name] for id in ids))
+            if losers:
+                reason = f"pinned by {node.pinned_by}" if node.pinned is not None else "newest"
+                self.skewed.append(f"{node.name}: using {node.variants[chosen[node.name]]['filename']} ({reason}), instead of the version locked by {', '.join(losers)}")
+
+        normalized: SubmissionLockfileFormat = {}
+        for platformid in self.order:
+            entry = copy.deepcopy(self.lock_data[platformid])
+            files = {}
+            for name in entry["files"]:
+                canonical = self.aliases.get(name, name)
+                if self.files[canonical].pinned_by == "pack":
+                    # Assembly ignores this file in favour of the pack's, so there's no reason to touch it
+                    files[canonical] = entry["files"][name]
+                else:
+                    files[canonical] = copy.deepcopy(self.files[canonical].variants[chosen[canonical]])
+            entry["files"] = files
+            normalized[platformid] = entry
+        return normalized
+
+    def print_report(self):
+        locked = sum(len(m["files"]) for m in self.lock_data.values())
+        print(f"{len(self.lock_data)} submissions lock {locked} files, {len(self.files)} of which are unique")
+        for name, canonical in sorted(self.aliases.items()):
+            print(f"{name} refers to the same mod as {canonical}, merging them")
+        for warning in self.warnings:
+            print(f"{Ansi.WARN}{warning}{Ansi.RESET}")
+        for skew in self.skewed:
+            print(f"{Ansi.WARN}Version skew:{Ansi.RESET} {skew}")
+        for conflict in self.conflicts:
+            print(f"{Ansi.ERROR}Conflict:{Ansi.RESET} {conflict}")
+
+def download_hash(filedata: dict[str, Any]) -> str:
+    download = filedata["download"]
+    return f"{download['hash-format']}:{download['hash']}"
+
+def version_key(filename: str) -> tuple[int, ...]:
+    """Rough guess of the version of a mod based on its filename. Good enough to compare versions of the same mod"""
+    return tuple(int(n) for n in re.findall(r"\d+", filename))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# Summarises a java flight recording of the test server into the hottest
+# mods/packages and the biggest allocation sites.
+# Usage: jfr_report.py <recording.jfr> <mods dir> <output dir>
+import json
+import re
+import subprocess
+import sys
+import zipfile
+from collections import Counter
+from pathlib import Path
+from typing import Any, Iterator
+
+import assemble_packwiz
+import common
+
+# How many entries are kept for each of the top lists
+TOP_N = 20
+# jfr only prints 5 frames by default, which isn't enough to find the mod responsible
+STACK_DEPTH = 64
+
+# Patterns for the text output of "jfr print"
+EVENT_START = re.compile(r"^(jdk\.\w+) \{$")
+# Frames look like "net.minecraft.server.MinecraftServer.tickServer(java.util.function.BooleanSupplier) line: 1034"
+FRAME = re.compile(r"^([\w.$/]+)\(")
+WEIGHT = re.compile(r"^weight = ([\d.,]+) ?(bytes?|kB|KB|MB|GB)$")
+BYTE_UNITS = {"byte": 1, "bytes": 1, "kB": 1024, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+def main():
+    if len(sys.argv) != 4:
+        print(f"Usage: {sys.argv[0]} <recording.jfr> <mods dir> <output dir>")
+        sys.exit(1)
+    java = common.check_java()
+    recording, mods_dir, output_dir = Path(sys.argv[1]), Path(sys.argv[2]), Path(sys.argv[3])
+    write_report(summarise(java, recording, mods_dir), output_dir)
+
+def summarise(java: Path, recording: Path, mods_dir: Path) -> dict[str, Any]:
+    package_owners = index_mod_packages(mods_dir)
+    jar_submissions = index_jar_submissions(common.get_repo_root() / "submissions-lock.json")
+
+    # The jfr tool ships with the jdk, right next to java
+    jfr = java.parent / ("jfr.exe" if java.suffix == ".exe" else "jfr")
+    if not jfr.exists():
+        raise RuntimeError(f"Couldn't find the jfr tool at {jfr}. Is {java} part of a full jdk?")
+    hot_packages: Counter[str] = Counter()
+    hot_mods: Counter[str] = Counter()
+    allocation_sites: Counter[str] = Counter()
+    allocation_mods: Counter[str] = Counter()
+    samples = 0
+    allocated = 0
+    # Recordings of a modded server are big, so the events are streamed instead of loading them all at once
+    for event_type, weight, frames in read_events(jfr, recording):
+        if len(frames) == 0:
+            continue
+        owner = find_owner(frames, package_owners)
+        if event_type == "jdk.ExecutionSample":
+            samples += 1
+            hot_packages[frames[0][0].rpartition(".")[0]] += 1
+            hot_mods[owner] += 1
+        elif event_type == "jdk.ObjectAllocationSample":
+            allocated += weight
+            allocation_sites[f"{frames[0][0]}.{frames[0][1]}"] += weight
+            allocation_mods[owner] += weight
+
+    return {
+        "recording": str(recording),
+        "execution_samples": samples,
+        "sampled_allocation_bytes": allocated,
+        "hot_mods": [
+            {"mod": mod, "samples": n, "percent": n / samples * 100, "submissions": jar_submissions.get(mod, [])}
+            for mod, n in hot_mods.most_common(TOP_N)
+        ],
+        "hot_packages": [
+            {"package": package, "samples": n, "percent": n / samples * 100}
+            for package, n in hot_packages.most_common(TOP_N)
+        ],
+        "allocating_mods": [
+            {"mod": mod, "bytes": n, "submissions": jar_submissions.get(mod, [])}
+            for mod, n in allocation_mods.most_common(TOP_N)
+        ],
+        "allocation_sites": [
+            {"method": site, "bytes": n}
+            for site, n in allocation_sites.most_common(TOP_N)
+        ],
+    }
+
+def read_events(jfr: Path, recording: Path) -> Iterator[tuple[str, int, list[tuple[str, str]]]]:
+    """Reads the execution and allocation samples from a recording using jfr's text output. Yields
+    tuples of (event type, allocation weight in bytes, stack frames). Frames are (class, method) tuples,
+    with the top of the stack first"""
+    process = subprocess.Popen([
+        jfr, "print",
+        "--stack-depth", str(STACK_DEPTH),
+        "--events", "jdk.ExecutionSample,jdk.ObjectAllocationSample",
+        recording
+    ], stdout=subprocess.PIPE, text=True)
+    assert process.stdout is not None
+    event_type = None
+    weight = 0
+    frames: list[tuple[str, str]] = []
+    in_stacktrace = False
+    for line in process.stdout:
+        line = line.strip()
+        if event_type is None:
+            if match := EVENT_START.match(line):
+                event_type, weight, frames = match.group(1), 0, []
+        elif in_stacktrace:
+            if line == "]":
+                in_stacktrace = False
+            elif match := FRAME.match(line):
+                clazz, _, method = match.group(1).rpartition(".")
+                frames.append((clazz, method))
+        elif line == "stackTrace = [":
+            in_stacktrace = True
+        elif match := WEIGHT.match(line):
+            weight = parse_bytes(match.group(1), match.group(2))
+        elif line == "}":
+            yield event_type, weight, frames
+            event_type = None
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+def parse_bytes(value: str, unit: str) -> int:
+    return int(float(value.replace(",", "")) * BYTE_UNITS[unit])
+
+def find_owner(frames: list[tuple[str, str]], package_owners: dict[str, str]) -> str:
+    """Finds the first mod jar on the stack. Falls back to minecraft or the jdk"""
+    fallback = None
+    for clazz, _ in frames:
+        package = clazz.rpartition(".")[0]
+        if package in package_owners:
+            return package_owners[package]
+        if fallback is None and package.startswith("net.minecraft"):
+            fallback = "minecraft"
+    return fallback or "other"
+
+def index_mod_packages(mods_dir: Path) -> dict[str, str]:
+    """Creates a mapping of java package to the name of the mod jar which contains it"""
+    owners = {}
+    for jar in sorted(mods_dir.glob("*.jar")):
+        try:
+            with zipfile.ZipFile(jar) as zip:
+                for name in zip.namelist():
+                    if name.endswith(".class") and "/" in name and not name.startswith("META-INF/"):
+                        owners.setdefault(name.rpartition("/")[0].replace("/", "."), jar.name)
+        except zipfile.BadZipFile:
+            print(f"Couldn't read {jar.name}, its classes won't be attributed to it")
+    return owners
+
+def index_jar_submissions(lock_file: Path) -> dict[str, list[str]]:
+    """Creates a mapping of jar name to the ids of all submissions which pulled it in"""
+    if not lock_file.exists():
+        return {}
+    jars: dict[str, list[str]] = {}
+    for platformid, moddata in assemble_packwiz.load_normalized_lock(lock_file).items():
+        for filedata in moddata.get("files", {}).values():
+            jars.setdefault(filedata["filename"], []).append(platformid)
+    return jars
+
+def write_report(summary: dict[str, Any], output_dir: Path):
+    output_dir.mkdir(exist_ok=True, parents=True)
+    with open(output_dir / "profile.json", "w") as f:
+        f.write(json.dumps(summary, indent=2))
+
+    lines = [f"{summary['execution_samples']} execution samples, {summary['sampled_allocation_bytes'] // (1024 * 1024)} MiB of sampled allocations", ""]
+    lines.append("Hottest mods:")
+    for e in summary["hot_mods"]:
+        submissions = f" (from {', '.join(e['submissions'])})" if e["submissions"] else ""
+        lines.append(f"  {e['percent']:5.1f}%  {e['mod']}{submissions}")
+    lines.append("")
+    lines.append("Hottest packages:")
+    for e in summary["hot_packages"]:
+        lines.append(f"  {e['percent']:5.1f}%  {e['package']}")
+    lines.append("")
+    lines.append("Most allocating mods:")
+    for e in summary["allocating_mods"]:
+        lines.append(f"  {e['bytes'] // (1024 * 1024):6} MiB  {e['mod']}")
+    lines.append("")
+    lines.append("Top allocation sites:")
+    for e in summary["allocation_sites"]:
+        lines.append(f"  {e['bytes'] // (1024 * 1024):6} MiB  {e['method']}")
+    with open(output_dir / "profile.txt", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    print(f"Wrote profiling report to {output_dir / 'profile.txt'}")
+
+if __name__ == "__main__":
+    main()
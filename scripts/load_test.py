@@ -0,0 +1,187 @@
+import json
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Any, TypedDict
+
+import common
+from common import Ansi
+
+DONE_PATTERN = re.compile(r"Done \([\d.,]+s\)!")
+# Output of /tick query, see commands.tick.query.rate.running in minecraft's lang file
+MSPT_PATTERN = re.compile(r"Average time per tick: ([\d.,]+) ?ms")
+PERCENTILES_PATTERN = re.compile(r"P50: ([\d.,]+) ?ms P95: ([\d.,]+) ?ms P99: ([\d.,]+) ?ms")
+
+class Thresholds(TypedDict, total=False):
+    max_mspt: float # Maximum average mspt over all samples
+    min_tps: float # Minimum average tps over all samples
+    max_memory_mb: float # Maximum memory usage seen in any sample
+
+class Scenario(TypedDict):
+    duration: float
+    chunk_radius: int
+    entities: dict[str, int]
+    sample_interval: float
+    thresholds: Thresholds
+
+def read_scenario(file: Path) -> Scenario:
+    scenario = common.jsonc_at_home(common.read_file(file))
+    for key in Scenario.__annotations__:
+        if key not in scenario:
+            raise RuntimeError(f"Load test scenario {file} does not define \"{key}\"")
+    if not 0 <= scenario["chunk_radius"] < 128:
+        # forceload is limited to 256 chunks per command, we issue one command per row
+        raise RuntimeError(f"chunk_radius should be between 0 and 127")
+    return scenario
+
+def run_load_test(command: list[Any], env: dict[str, str] | None, scenario: Scenario, report_file: Path) -> bool:
+    """Runs the server under load for the duration of the scenario. Returns whether the thresholds were met"""
+    server = subprocess.Popen(command, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    assert server.stdin is not None and server.stdout is not None
+    output: queue.Queue[str] = queue.Queue()
+    threading.Thread(target=forward_output, args=(server.stdout, output), daemon=True).start()
+
+    def send(cmd: str):
+        assert server.stdin is not None
+        try:
+            server.stdin.write(cmd + "\n")
+            server.stdin.flush()
+        except BrokenPipeError:
+            pass # The server exited, which will be noticed while waiting for its output
+
+    samples = []
+    failures = []
+    try:
+        if wait_for(output, DONE_PATTERN, 240, server) is None:
+            failures.append("Server did not finish starting")
+        else:
+            # Everything is relative to the world spawn, which is where commands from the console are executed
+            radius = scenario["chunk_radius"]
+            print(f"Force-loading {(radius * 2 + 1) ** 2} chunks around spawn")
+            for z in range(-radius, radius + 1):
+                send(f"forceload add ~{-radius * 16} ~{z * 16} ~{radius * 16} ~{z * 16}")
+            # Vanilla doesn't support fake players, so load is simulated using entities
+            for entity, count in scenario["entities"].items():
+                print(f"Summoning {count} {entity}")
+                for _ in range(count):
+                    send(f"summon {entity}")
+
+            start = time.monotonic()
+            while time.monotonic() - start < scenario["duration"]:
+                time.sleep(scenario["sample_interval"])
+                send("tick query")
+                sample = take_sample(output, server)
+                if sample is None:
+                    failures.append("Server stopped responding to /tick query")
+                    break
+                sample["time"] = time.monotonic() - start
+                samples.append(sample)
+    finally:
+        if server.poll() is None:
+            send("stop")
+            try:
+                server.wait(timeout=120)
+            except subprocess.TimeoutExpired:
+                print(f"{Ansi.WARN}Server did not stop, killing it{Ansi.RESET}")
+                server.kill()
+                server.wait()
+
+    summary = summarise(samples)
+    failures += check_thresholds(summary, scenario["thresholds"])
+    if server.returncode != 0:
+        failures.append(f"Server exited with status code {server.returncode}")
+
+    report_file.parent.mkdir(exist_ok=True, parents=True)
+    with open(report_file, "w") as f:
+        f.write(json.dumps({
+            "scenario": scenario,
+            "summary": summary,
+            "samples": samples,
+            "failures": failures,
+            "passed": len(failures) == 0
+        }, indent=2))
+    print(f"Wrote load test results to {report_file}")
+    for failure in failures:
+        print(f"{Ansi.ERROR}! {failure}{Ansi.RESET}")
+    return len(failures) == 0
+
+def forward_output(stream, output: "queue.Queue[str]"):
+    """Echos the server's output while also making it available to the load test"""
+    for line in stream:
+        print(line, end="", flush=True)
+        output.put(line)
+
+def wait_for(output: "queue.Queue[str]", pattern: re.Pattern, timeout: float, server: subprocess.Popen) -> re.Match | None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            line = output.get(timeout=1)
+        except queue.Empty:
+            if server.poll() is not None:
+                return None
+            continue
+        if match := pattern.search(line):
+            return match
+    return None
+
+def take_sample(output: "queue.Queue[str]", server: subprocess.Popen) -> dict[str, Any] | None:
+    match = wait_for(output, MSPT_PATTERN, 30, server)
+    if match is None:
+        return None
+    mspt = parse_number(match.group(1))
+    sample: dict[str, Any] = {
+        "mspt": mspt,
+        # The server can't tick faster than 20 tps
+        "tps": min(20.0, 1000 / mspt) if mspt > 0 else 20.0,
+        "memory_mb": get_memory_mb(server.pid),
+    }
+    if percentiles := wait_for(output, PERCENTILES_PATTERN, 5, server):
+        sample["mspt_p50"], sample["mspt_p95"], sample["mspt_p99"] = (parse_number(p) for p in percentiles.groups())
+    return sample
+
+def parse_number(value: str) -> float:
+    return float(value.replace(",", "."))
+
+def get_memory_mb(pid: int) -> float | None:
+    """Resident memory of a process and all of its children (neoforge launches java from a script). Only works on linux"""
+    total_kb = 0
+    pending = [pid]
+    try:
+        while pending:
+            p = pending.pop()
+            for line in common.read_file(Path(f"/proc/{p}/status")).split("\n"):
+                if line.startswith("VmRSS:"):
+                    total_kb += int(line.split()[1])
+            for task in os.listdir(f"/proc/{p}/task"):
+                pending += [int(c) for c in common.read_file(Path(f"/proc/{p}/task/{task}/children")).split()]
+    except (OSError, ValueError):
+        if total_kb == 0:
+            return None
+    return total_kb / 1024
+
+def summarise(samples: list[dict[str, Any]]) -> dict[str, Any]:
+    if len(samples) == 0:
+        return {}
+    memory = [s["memory_mb"] for s in samples if s["memory_mb"] is not None]
+    return {
+        "average_mspt": sum(s["mspt"] for s in samples) / len(samples),
+        "worst_mspt": max(s["mspt"] for s in samples),
+        "average_tps": sum(s["tps"] for s in samples) / len(samples),
+        "peak_memory_mb": max(memory) if memory else None,
+    }
+
+def check_thresholds(summary: dict[str, Any], thresholds: Thresholds) -> list[str]:
+    if len(summary) == 0:
+        return ["No samples were taken"]
+    failures = []
+    if "max_mspt" in thresholds and summary["average_mspt"] > thresholds["max_mspt"]:
+        failures.append(f"Average mspt {summary['average_mspt']:.1f} exceeds the maximum of {thresholds['max_mspt']}")
+    if "min_tps" in thresholds and summary["average_tps"] < thresholds["min_tps"]:
+        failures.append(f"Average tps {summary['average_tps']:.1f} is below the minimum of {thresholds['min_tps']}")
+    if "max_memory_mb" in thresholds and summary["peak_memory_mb"] is not None and summary["peak_memory_mb"] > thresholds["max_memory_mb"]:
+        failures.append(f"Peak memory usage of {summary['peak_memory_mb']:.0f}MB exceeds the maximum of {thresholds['max_memory_mb']}MB")
+    return failures
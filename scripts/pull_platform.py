@@ -9,7 +9,9 @@ import tomllib
 import urllib.request
 from pathlib import Path
 
+import assemble_packwiz
 import common
+import dependency_graph
 from assemble_packwiz import SubmissionLockfileFormat
 from common import Ansi
 
@@ -51,8 +53,9 @@ def main():
     for mod_id in submissions_by_id:
         platform_info = submissions_by_id[mod_id]
         lock_info = lock_data.get(mod_id) # Might be None
-        # If the url changes we need to update the lock data. This is the only use of 'url' in the lock file
-        if lock_info is None or lock_info["url"] != platform_info["download"]:
+        # If the url changes we need to update the lock data. This is the only use of 'url' in the lock file.
+        # Entries from before the main file was recorded are resolved again
+        if lock_info is None or lock_info["url"] != platform_info["download"] or "main" not in lock_info:
             print(f"Updating lock data for {mod_id}")
             lock_info = {} # Reset the lock info for this mod
             assert lock_info is not None # mypy is quite stupid
@@ -78,17 +81,39 @@ def main():
                 
                 # Now lets see which files packwiz thought we should download
                 files = {}
+                main_file = None
                 for packwiz_meta in os.listdir(tmpdir / "mods"):
                     packwiz_data = tomllib.loads(common.read_file(tmpdir / "mods" / packwiz_meta))
+                    if mod_type != None and mod_type.get("type") == "modrinth":
+                        # Dependencies are installed from other versions, so the version id identifies the submission itself
+                        if packwiz_data["update"].get("modrinth", {}).get("version") == mod_type["version_id"]:
+                            main_file = packwiz_meta
+                    else:
+                        # Packwiz doesn't resolve dependencies for urls, so there's only one file
+                        main_file = packwiz_meta
                     del packwiz_data["update"]
                     files[packwiz_meta] = packwiz_data
+                if main_file == None:
+                    print(f"{Ansi.WARN}Couldn't find the main file of {mod_id}, it won't be pinned when reconciling dependencies{Ansi.RESET}")
                 lock_info["files"] = files
+                lock_info["main"] = main_file
         lock_data[mod_id] = lock_info
     
     # Write the update lock data back
     with open(submission_lock_file, "w") as f:
         f.write(json.dumps(lock_data, indent=2, sort_keys=True))
 
+    # Every submission was resolved on its own, make sure shared dependencies end up at a single version.
+    # The lock file is kept as is, so submissions which didn't change don't need to be resolved again
+    graph = dependency_graph.DependencyGraph(lock_data, repo_root / "pack")
+    normalized = graph.normalize()
+    graph.print_report()
+    if len(graph.conflicts) > 0:
+        # The stale normalized lock makes sure the pack can't be assembled until the conflicts are fixed
+        print(f"{Ansi.ERROR}Not updating {assemble_packwiz.normalized_lock_file(submission_lock_file).name} because of the conflicts above{Ansi.RESET}")
+    else:
+        assemble_packwiz.write_normalized_lock(submission_lock_file, normalized)
+
     # Make it clear that this script didn't really do anything if event_name is null
     if event_name == None:
         sys.exit(1)
@@ -6,12 +6,18 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import time
+import tomllib
 import urllib.request
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, NewType, Optional
 
 import assemble_packwiz
+import cache
 import common
+import jfr_report
+import load_test
 from common import Ansi
 
 FABRIC_INSTALLER_VERSION = "1.0.1"
@@ -24,6 +30,23 @@ def main():
     pack = common.get_generated_dir() / "pack"
     pack_toml_file = pack / "pack.toml"
     test_server_working = Path(common.env("WORK_DIR", default=(repo_root / "run")))
+    if sys.argv[1:] == ["gc"]:
+        gc(test_server_working)
+        return
+
+    # Prevent other runs from touching the generated pack, the cache or the exec dir. Held until this process exits
+    work_dir_lock = cache.lock_work_dir(test_server_working)
+    profile_name = common.env("JVM_PROFILE", default="plain")
+    if profile_name not in JVM_PROFILES:
+        raise RuntimeError(f"Unknown JVM_PROFILE '{profile_name}'. Valid profiles are: {', '.join(JVM_PROFILES.keys())}")
+    jvm_profile = JVM_PROFILES[profile_name]
+    profiler = common.env("PROFILER")
+    if profiler not in [None, "jfr"]:
+        raise RuntimeError(f"Unknown PROFILER '{profiler}'. Only 'jfr' is supported")
+    report_dir = Path(common.env("REPORT_DIR", default=(test_server_working / "reports"))).resolve()
+    load_test_scenario = None
+    if scenario_file := common.env("LOAD_TEST_SCENARIO"):
+        load_test_scenario = load_test.read_scenario(Path(scenario_file))
 
     # Run the pack assembly script
     assemble_packwiz.main()
@@ -48,27 +71,14 @@ def main():
     print(f"Setting up a {loader} {loader_version} server for {mc_version}")
 
     # Various run dirs and files
-    # This is the cache for things that don't change very often
-    static_cache_dir = test_server_working / "cache-static"
-    cache_state_file = static_cache_dir / "cache_state.json" # Info about the cache
-    cached_server_dir = static_cache_dir / "server" # Dir containing the server jar and libraries
-    cached_packwiz_dir = static_cache_dir / "packwiz" # Dir containing packwiz installer and packwiz bootstrap
-    cached_injector_dir = static_cache_dir / "mc-test-injector" # Dir where mc-test-injector will be downloaded to
-
-    # This is the cache that does change quite often (eg, whenever the mods change)
-    # These are all managed by external programs, so they don't need a state file
-    dynamic_cache_dir = test_server_working / "cache-dynamic"
-    cached_pack_dir = dynamic_cache_dir / "pack" # Dir containing an instance of the pack
-    runtime_cache = dynamic_cache_dir / "runtime" # Dirs which are known to contain caches maintained by the server (e.g .fabric)
+    registry = create_cache_registry(test_server_working)
+    cached_server_dir = registry.components["server"].directory
+    cached_packwiz_dir = registry.components["pw_bootstrap"].directory
+    cached_injector_dir = registry.components["mc-test-injector"].directory
+    cached_pack_dir = registry.unmanaged["pack"]
+    runtime_cache = registry.unmanaged["runtime"]
     exec_dir = test_server_working / "exec" # Where the server will end up running
 
-    cached_server_dir.mkdir(exist_ok=True, parents=True)
-    cached_pack_dir.mkdir(exist_ok=True, parents=True)
-    cached_packwiz_dir.mkdir(exist_ok=True, parents=True)
-    cached_injector_dir.mkdir(exist_ok=True, parents=True)
-    runtime_cache.mkdir(exist_ok=True, parents=True)
-    exec_dir.mkdir(exist_ok=True, parents=True)
-
     # Generate the desired cache state so we can compare it
     desired_cache_state = {
         "server": common.hash([mc_version, loader, loader_version]),
@@ -76,88 +86,17 @@ def main():
         "mc-test-injector": MC_TEST_INJECTOR_VERSION
     }
     if common.env("GENERATE_DESIRED_CACHE_STATE_AND_EXIT") == "true":
-        save_cache_state(desired_cache_state, test_server_working / "desired_cache_state_for_static_cache.json")
+        registry.save_state(desired_cache_state, test_server_working / "desired_cache_state_for_static_cache.json")
         sys.exit()
         return
 
-    # Read the file describing the state of the current cache
-    if cache_state_file.exists():
-        try:
-            cached_state = json.loads(common.read_file(cache_state_file))
-        except Exception:
-            print(f"Failed to load cache state, ignoring it")
-            cached_state = {}
-    else:
-        cached_state = {}
-    
-    # Make sure we have an install of the server files
-    server_hash = desired_cache_state["server"]
-    if server_hash != cached_state.get("server"):
-        print("Existing cached server files are stale. Deleting it.")
-        shutil.rmtree(cached_server_dir)
-        shutil.rmtree(runtime_cache)
-        cached_state["server"] = None
-        save_cache_state(cached_state, cache_state_file) # Don't forget to immediatly save any changes to the state
-    elif err := validate_server(loader, cached_server_dir):
-        print(f"{Ansi.WARN}Something is wrong with the cached server:{Ansi.RESET} {err}")
-        print("Removing cached server files")
-        shutil.rmtree(cached_server_dir)
-        shutil.rmtree(runtime_cache)
-        cached_state["server"] = None
-        save_cache_state(cached_state, cache_state_file) # Don't forget to immediatly save any changes to the state
-    
-    if cached_state.get("server") == None:
-        # Set up new server files
-        setup_server(java, mc_version, loader, loader_version, cached_server_dir)
-        # Update cache state to reflect the newly installed server files
-        cached_state["server"] = server_hash
-        save_cache_state(cached_state, cache_state_file)
-    else:
-        print(f"Cache hit: a {mc_version} server using {loader} {loader_version} is in the cache")
-    
-    # Make sure we have an install of packwiz
-    bootstrap_version = desired_cache_state["pw_bootstrap"]
-    if bootstrap_version != cached_state.get("pw_bootstrap"):
-        print("Installed packwiz bootstrap is stale. Deleting it.")
-        shutil.rmtree(cached_packwiz_dir)
-        cached_state["pw_bootstrap"] = None
-        save_cache_state(cached_state, cache_state_file)
-    elif err := validate_packwiz(cached_packwiz_dir):
-        print(f"{Ansi.WARN}Something is wrong with the cached packwiz installer or bootstrap:{Ansi.RESET} {err}")
-        shutil.rmtree(cached_packwiz_dir)
-        cached_state["pw_bootstrap"] = None
-        save_cache_state(cached_state, cache_state_file)
-
-    if cached_state.get("pw_bootstrap") == None:
-        # Set up new server files
-        setup_packwiz_bootstrap(java, bootstrap_version, cached_packwiz_dir)
-        # Update cache state to reflect the newly installed packwiz
-        cached_state["pw_bootstrap"] = bootstrap_version
-        save_cache_state(cached_state, cache_state_file)
-    else:
-        print(f"Cache hit: packwiz bootstrap {bootstrap_version} is in the cache")
-
-    # Make sure we have an install of mc test injector
-    injector_version = desired_cache_state["mc-test-injector"]
-    if injector_version != cached_state.get("mc-test-injector"):
-        print("Installed mc-test-injector is stale. Deleting it.")
-        shutil.rmtree(cached_injector_dir)
-        cached_state["mc-test-injector"] = None
-        save_cache_state(cached_state, cache_state_file)
-    elif err := validate_test_injector(cached_injector_dir):
-        print(f"{Ansi.WARN}Something is wrong with the cached mc-test-injector:{Ansi.RESET} {err}")
-        shutil.rmtree(cached_injector_dir)
-        cached_state["mc-test-injector"] = None
-        save_cache_state(cached_state, cache_state_file)
-
-    if cached_state.get("mc-test-injector") == None:
-        # Set up new server files
-        setup_mc_test_injector(java, injector_version, cached_injector_dir)
-        # Update cache state to reflect the newly installed mc-test-injector
-        cached_state["mc-test-injector"] = injector_version
-        save_cache_state(cached_state, cache_state_file)
-    else:
-        print(f"Cache hit: mc-test-injector {injector_version} is in the cache")
+    # Make sure we have an install of the server files, packwiz and mc test injector
+    registry.ensure_all(desired_cache_state, CacheContext(java, pack_info))
+    registry.print_usage()
+
+    cached_pack_dir.mkdir(exist_ok=True, parents=True)
+    runtime_cache.mkdir(exist_ok=True, parents=True)
+    exec_dir.mkdir(exist_ok=True, parents=True)
 
     # Update the pack dir;
     # it should have all the files in the pack downloaded
@@ -216,9 +155,41 @@ def main():
     java_args = [f"-javaagent:{test_injector}"]
     mc_args = ["--nogui"]
 
+    # Apply the jvm launch profile
+    java_args += jvm_profile_args(jvm_profile)
+    cds_state = "none"
+    if jvm_profile.cds:
+        # The archive is only valid for this exact set of classes, so it's keyed by the index hash of the pack
+        archive_key = common.hash([read_index_hash(pack_toml_file), str(java)])[:16]
+        cds_state, cds_args = cds_archive_args(runtime_cache, archive_key)
+        java_args += cds_args
+    print(f"Using jvm profile {profile_name}: {' '.join(java_args[1:])}")
+
+    if profiler == "jfr":
+        # Records from launch until the server exits, which the test injector does once it's done starting
+        report_dir.mkdir(exist_ok=True, parents=True)
+        recording = report_dir / "profile.jfr"
+        if recording.exists():
+            recording.unlink()
+        java_args.append(f"-XX:StartFlightRecording=filename={recording},settings=profile,dumponexit=true")
+        print(f"Recording a flight recording to {recording}")
+
     sys.stdout.flush() # Prevents python's output from appearing after mc's
     os.chdir(exec_dir)
+    boot_start = time.monotonic()
     result = run_server(exec_dir, java, loader, java_args, mc_args, timeout=240)
+    boot_time = time.monotonic() - boot_start
+
+    if profiler == "jfr":
+        # Also useful if the test failed, so do this before checking the result
+        if recording.exists():
+            # Profiling is optional, failing to summarise it shouldn't hide the result of the test
+            try:
+                jfr_report.write_report(jfr_report.summarise(java, recording, exec_dir / "mods"), report_dir)
+            except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+                print(f"{Ansi.WARN}Failed to summarise the flight recording:{Ansi.RESET} {e}")
+        else:
+            print(f"{Ansi.WARN}The server didn't write a flight recording{Ansi.RESET}")
 
     if result.returncode != 0:
         print(f"! Minecraft returned status code {result.returncode}")
@@ -230,11 +201,151 @@ def main():
         print(f"! Found files in the crash-reports directory. Marking test as failed")
         sys.exit(2)
 
-def save_cache_state(state, file):
-    # This is nice to store, for if we ever make breaking changes
-    state["script_version"] = 1
-    with open(file, "w") as f:
-        f.write(json.dumps(state, sort_keys=True))
+    # Only successful runs are recorded, a crash can make a run look a lot faster or slower than it is
+    report_boot_time(runtime_cache / "boot_times.json", profile_name, cds_state, boot_time)
+
+    if load_test_scenario is not None:
+        print(f"Starting load test for {load_test_scenario['duration']}s")
+        # The test injector would stop the server as soon as it's started, so it's left out here
+        load_java_args = jvm_profile_args(jvm_profile)
+        if jvm_profile.cds:
+            load_java_args += cds_archive_args(runtime_cache, archive_key)[1]
+        command, env = server_command(exec_dir, java, loader, load_java_args, mc_args)
+        sys.stdout.flush()
+        passed = load_test.run_load_test(command, env, load_test_scenario, report_dir / "load-test.json")
+        if crashreport_dir.exists() and len(list(crashreport_dir.iterdir())) > 0:
+            print(f"! Found files in the crash-reports directory after the load test. Marking test as failed")
+            sys.exit(2)
+        if not passed:
+            print(f"! Load test failed")
+            sys.exit(3)
+
+@dataclass
+class JvmProfile:
+    heap: bool # Size the heap based on the memory available on this machine
+    gc: str | None = None # Name of the garbage collector to use, or None for the jvm's default
+    cds: bool = False # Use a dynamic class-data-sharing archive
+    extra_args: list[str] = field(default_factory=list)
+
+JVM_PROFILES = {
+    # No tuning at all
+    "plain": JvmProfile(heap=False),
+    "tuned": JvmProfile(heap=True, gc="G1"),
+    "cds": JvmProfile(heap=True, gc="G1", cds=True),
+    # The test server only lives for a short while, so it doesn't benefit much from C2 or a concurrent gc
+    "fast-boot": JvmProfile(heap=True, gc="Serial", cds=True, extra_args=["-XX:TieredStopAtLevel=1"]),
+}
+
+def jvm_profile_args(profile: JvmProfile) -> list[str]:
+    """Get the jvm arguments for a profile. Does not include the arguments for the cds archive"""
+    args = []
+    if profile.heap:
+        heap_mb = get_heap_size_mb()
+        args += [f"-Xms{heap_mb}M", f"-Xmx{heap_mb}M"]
+    if profile.gc:
+        args.append(f"-XX:+Use{profile.gc}GC")
+    return args + profile.extra_args
+
+def get_heap_size_mb() -> int:
+    """Picks a heap size based on the available memory. Uses half of it, clamped between 1 and 8 GiB"""
+    available = None
+    try:
+        # MemAvailable takes caches into account, so it's more accurate than sysconf's value
+        for line in common.read_file(Path("/proc/meminfo")).split("\n"):
+            if line.startswith("MemAvailable:"):
+                available = int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    if available is None:
+        try:
+            available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+        except (ValueError, OSError, AttributeError):
+            # Not available on windows
+            available = 4096
+    return max(1024, min(8192, available // 2))
+
+def read_index_hash(pack_toml_file: Path) -> str:
+    return tomllib.loads(common.read_file(pack_toml_file))["index"]["hash"]
+
+def cds_archive_args(runtime_cache: Path, key: str) -> tuple[str, list[str]]:
+    """Returns the state of the cds archive ("archive" or "generating") and the jvm arguments needed to use it"""
+    archive = (runtime_cache / f"cds-{key}.jsa").resolve()
+    # Archives for older versions of the pack are useless
+    for old_archive in runtime_cache.glob("cds-*.jsa"):
+        if old_archive.name != archive.name:
+            print(f"Removing stale cds archive {old_archive.name}")
+            old_archive.unlink()
+    if archive.exists():
+        print(f"Cache hit: using cds archive {archive.name}")
+        # If the archive turns out to be invalid the jvm will ignore it (-Xshare:auto is the default)
+        return "archive", [f"-XX:SharedArchiveFile={archive}"]
+    else:
+        print(f"No cds archive for this pack, it will be generated when the server exits")
+        return "generating", [f"-XX:ArchiveClassesAtExit={archive}"]
+
+def report_boot_time(boot_times_file: Path, profile_name: str, cds_state: str, boot_time: float):
+    """Prints the boot time, compared against previous runs which didn't use a cds archive"""
+    try:
+        boot_times = json.loads(common.read_file(boot_times_file))
+    except (OSError, ValueError):
+        boot_times = {}
+    print(f"Server ran for {boot_time:.1f}s (profile {profile_name}, cds: {cds_state})")
+    if cds_state == "archive":
+        # Runs which generated the archive also paid for dumping it, so they're not a fair comparison
+        baselines = {k: v for k, v in boot_times.items() if k.endswith("/none")}
+        for key, baseline in sorted(baselines.items()):
+            change = (boot_time - baseline) / baseline * 100
+            print(f"Last run without an archive ({key}) took {baseline:.1f}s ({change:+.0f}%)")
+        if len(baselines) == 0:
+            print("No runs without an archive have been recorded yet. Run once using a profile without cds to compare against")
+    boot_times[f"{profile_name}/{cds_state}"] = boot_time
+    common.write_file_atomic(boot_times_file, json.dumps(boot_times, indent=2, sort_keys=True))
+
+@dataclass
+class CacheContext:
+    java: Path
+    pack_info: common.PackwizPackInfo
+
+def create_cache_registry(test_server_working: Path) -> cache.CacheRegistry:
+    # This is the cache for things that don't change very often
+    static_cache_dir = test_server_working / "cache-static"
+    # This is the cache that does change quite often (eg, whenever the mods change)
+    # These are all managed by external programs, so they're not in the state file
+    dynamic_cache_dir = test_server_working / "cache-dynamic"
+    runtime_cache = dynamic_cache_dir / "runtime" # Dirs which are known to contain caches maintained by the server (e.g .fabric)
+
+    registry = cache.CacheRegistry(static_cache_dir / "cache_state.json", [static_cache_dir, dynamic_cache_dir])
+    registry.register(cache.CacheComponent(
+        "server", "server install",
+        static_cache_dir / "server", # Dir containing the server jar and libraries
+        install=lambda d, _, ctx: setup_server(ctx.java, ctx.pack_info.minecraft_version, ctx.pack_info.loader, ctx.pack_info.loader_version, d),
+        validate=lambda d, ctx: validate_server(ctx.pack_info.loader, d),
+        # The runtime caches are only valid for a specific server install
+        dependents=[runtime_cache]
+    ))
+    registry.register(cache.CacheComponent(
+        "pw_bootstrap", "packwiz bootstrap",
+        static_cache_dir / "packwiz", # Dir containing packwiz installer and packwiz bootstrap
+        install=lambda d, version, ctx: setup_packwiz_bootstrap(ctx.java, version, d),
+        validate=lambda d, _: validate_packwiz(d)
+    ))
+    registry.register(cache.CacheComponent(
+        "mc-test-injector", "mc-test-injector",
+        static_cache_dir / "mc-test-injector", # Dir where mc-test-injector will be downloaded to
+        install=lambda d, version, ctx: setup_mc_test_injector(ctx.java, version, d),
+        validate=lambda d, _: validate_test_injector(d)
+    ))
+    registry.keep("pack", dynamic_cache_dir / "pack") # Dir containing an instance of the pack
+    registry.keep("runtime", runtime_cache)
+    return registry
+
+def gc(test_server_working: Path):
+    """Removes anything from the cache that isn't used anymore"""
+    work_dir_lock = cache.lock_work_dir(test_server_working)
+    registry = create_cache_registry(test_server_working)
+    freed = registry.gc()
+    print(f"Freed {common.format_size(freed)}")
+    registry.print_usage()
 
 def setup_server(java, mc_version, loader, loader_version, directory):
     """Install the server files and libraries for a given version. The given directory should be empty"""
@@ -298,8 +409,13 @@ def validate_test_injector(packwiz_dir) -> str | None:
     return None
 
 def run_server(exec_dir, java, loader, java_args, mc_args, **kwargs) -> subprocess.CompletedProcess[Any]:
+    command, env = server_command(exec_dir, java, loader, java_args, mc_args)
+    return subprocess.run(command, env=env, **kwargs)
+
+def server_command(exec_dir, java, loader, java_args, mc_args) -> tuple[list[Any], dict[str, str] | None]:
+    """Returns the command and environment used to launch the server"""
     if loader == "fabric":
-        return subprocess.run([java] + java_args + ["-jar", exec_dir / "fabric-server-launch.jar"] + mc_args, **kwargs)
+        return [java] + java_args + ["-jar", exec_dir / "fabric-server-launch.jar"] + mc_args, None
     elif loader == "neoforge":
         env = {}
         # Pass the jdk options as an env variable
@@ -315,7 +431,7 @@ def run_server(exec_dir, java, loader, java_args, mc_args, **kwargs) -> subproce
         
         # Run the bash file
         bash_file = "run.bat" if os.name == "nt" else "run.sh"
-        return subprocess.run([exec_dir / bash_file] + mc_args, env=env, **kwargs)
+        return [exec_dir / bash_file] + mc_args, env
     else:
         raise RuntimeError(f"Unknown loader {loader}, can't run server")
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# Reports how many bytes the generated pack costs to download, and who is responsible for them.
+# Run after assemble_packwiz.py
+import json
+import tomllib
+import urllib.request
+from pathlib import Path
+from typing import Any
+
+import assemble_packwiz
+import common
+
+
+def main():
+    repo_root = common.get_repo_root()
+    submission_lock_file = repo_root / "submissions-lock.json"
+    source_pack = repo_root / "pack"
+    exclude_file = repo_root / "platform.ignore"
+    generated_dir = common.get_generated_dir()
+    pack = generated_dir / "pack"
+    # Sizes are taken from the files downloaded by run_test, or from the report by check_urls
+    cached_pack = Path(common.env("WORK_DIR", default=(repo_root / "run"))) / "cache-dynamic" / "pack"
+    url_report_file = Path(common.env("URL_REPORT", default=(generated_dir / "url-health.json")))
+    report_file = generated_dir / "size-report.json"
+
+    if not (pack / "index.toml").exists():
+        raise RuntimeError(f"{pack / 'index.toml'} does not exist. Please run assemble_packwiz.py first")
+
+    url_sizes = {}
+    if url_report_file.exists():
+        url_sizes = {url: r["size"] for url, r in json.loads(common.read_file(url_report_file))["urls"].items()}
+
+    # Find out which submissions brought in which file
+    exclusions = assemble_packwiz.read_exclusions(exclude_file)
+    providers: dict[str, list[str]] = {}
+    for platformid, moddata in assemble_packwiz.load_normalized_lock(submission_lock_file).items():
+        if platformid in exclusions:
+            continue
+        for filename in moddata["files"]:
+            providers.setdefault(f"mods/{filename}", []).append(platformid)
+
+    files = {}
+    index = tomllib.loads(common.read_file(pack / "index.toml"))
+    for entry in index.get("files", []):
+        path = entry["file"]
+        # The pack always takes priority over submissions, but shared libraries in the pack are still
+        # downloaded because of the submissions which need them
+        source = "pack" if (source_pack / path).exists() or path not in providers else "submission"
+        owners = sorted(providers.get(path, ["pack"]))
+        files[path] = describe_file(pack, path, entry, cached_pack, url_sizes) | {"submissions": owners, "source": source}
+
+    previous_index = load_previous_index()
+    report = create_report(files, previous_index)
+    common.write_file_atomic(report_file, json.dumps(report, indent=2, sort_keys=True))
+    print_report(report)
+    print(f"Wrote report to {report_file}")
+
+def describe_file(pack: Path, path: str, index_entry: dict[str, Any], cached_pack: Path, url_sizes: dict[str, int | None]) -> dict[str, Any]:
+    """Finds the size and side of a file in the pack. For metafiles, this is the file it refers to"""
+    if not index_entry.get("metafile", False):
+        return {"name": path, "size": (pack / path).stat().st_size, "side": "both", "hash": index_entry["hash"]}
+    meta = tomllib.loads(common.read_file(pack / path))
+    artifact = cached_pack / Path(path).parent / meta["filename"]
+    if artifact.exists():
+        size = artifact.stat().st_size
+    else:
+        size = url_sizes.get(meta["download"]["url"])
+    return {"name": meta["filename"], "size": size, "side": meta.get("side", "both"), "hash": index_entry["hash"]}
+
+def load_previous_index() -> dict[str, str] | None:
+    """Loads the index.toml of the deployed pack, as a mapping from file to hash"""
+    location = common.env("PREVIOUS_INDEX")
+    if location is None and (url := common.env("URL")) is not None and url.endswith("pack.toml"):
+        # URL is the public url of the pack.toml, which is next to the index
+        location = url.removesuffix("pack.toml") + "index.toml"
+    if location is None:
+        print("Set PREVIOUS_INDEX or URL to see how much players will need to download when updating")
+        return None
+    try:
+        if "://" in location:
+            with urllib.request.urlopen(location) as response:
+                index = tomllib.loads(response.read().decode("utf-8"))
+        else:
+            index = tomllib.loads(common.read_file(Path(location)))
+    except Exception as e:
+        print(f"Couldn't load previous index from {location}: {e}")
+        return None
+    return {entry["file"]: entry["hash"] for entry in index.get("files", [])}
+
+def create_report(files: dict[str, dict[str, Any]], previous_index: dict[str, str] | None) -> dict[str, Any]:
+    submissions: dict[str, dict[str, int]] = {}
+    sides = {"client": 0, "server": 0}
+    for path, f in files.items():
+        size = f["size"] or 0
+        for side in sides:
+            if f["side"] in ["both", side]:
+                sides[side] += size
+        for owner in f["submissions"]:
+            s = submissions.setdefault(owner, {"own": 0, "shared": 0, "total": 0, "files": 0})
+            s["total"] += size
+            s["files"] += 1
+            if len(f["submissions"]) == 1:
+                s["own"] += size
+            else:
+                # Shared dependencies are split evenly between everyone who uses them
+                s["shared"] += size // len(f["submissions"])
+
+    report: dict[str, Any] = {
+        "total": sum(f["size"] or 0 for f in files.values()),
+        "unknown_sizes": sorted(path for path, f in files.items() if f["size"] is None),
+        "sides": sides,
+        "submissions": submissions,
+        "dependencies": {path: f for path, f in files.items() if len(f["submissions"]) > 1},
+        "files": files,
+    }
+    if previous_index is not None:
+        changed = [path for path, f in files.items() if previous_index.get(path) != f["hash"]]
+        report["update"] = {
+            "changed": sorted(changed),
+            "removed": sorted(path for path in previous_index if path not in files),
+            "download": sum(files[path]["size"] or 0 for path in changed),
+        }
+    return report
+
+def print_report(report: dict[str, Any]):
+    size = common.format_size
+    rows = [("submission", "files", "own", "shared", "total")]
+    for id, s in sorted(report["submissions"].items(), key=lambda e: -(e[1]["own"] + e[1]["shared"])):
+        rows.append((id, str(s["files"]), size(s["own"]), size(s["shared"]), size(s["total"])))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join([row[0].ljust(widths[0])] + [c.rjust(w) for c, w in zip(row[1:], widths[1:])]))
+    print()
+    print(f"Total: {size(report['total'])} (client {size(report['sides']['client'])}, server {size(report['sides']['server'])})")
+    if len(report["unknown_sizes"]) > 0:
+        print(f"Size of {len(report['unknown_sizes'])} files is unknown. Run check_urls.py or run_test.py to find them")
+    if "update" in report:
+        update = report["update"]
+        print(f"Updating from the previous version: {len(update['changed'])} files changed, {len(update['removed'])} removed, {size(update['download'])} to download")
+
+if __name__ == "__main__":
+    main()
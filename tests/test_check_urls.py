@@ -0,0 +1,123 @@
+import http.server
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
+import check_urls
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    requests: list[tuple[str, str, str | None]] = []
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self):
+        StubHandler.requests.append((self.command, self.path, self.headers.get("Range")))
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/file")
+            self.end_headers()
+        elif self.path == "/no-head" and self.command == "HEAD":
+            self.send_response(405)
+            self.end_headers()
+        elif self.path == "/missing":
+            self.send_response(404)
+            self.end_headers()
+        elif self.command == "HEAD":
+            self.send_response(200)
+            self.send_header("Content-Length", "1234")
+            self.end_headers()
+        elif self.headers.get("Range") == "bytes=0-0":
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes 0-0/999")
+            self.send_header("Content-Length", "1")
+            self.end_headers()
+            self.wfile.write(b"x")
+        else:
+            self.send_response(200)
+            self.send_header("Content-Length", "4")
+            self.end_headers()
+            self.wfile.write(b"full")
+
+    do_HEAD = respond
+    do_GET = respond
+
+
+class CheckUrlsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        StubHandler.requests.clear()
+
+    def test_head(self):
+        result = check_urls.check_url(f"{self.base}/file", 5)
+        self.assertTrue(result["ok"])
+        self.assertEqual(result["size"], 1234)
+
+    def test_redirect_keeps_head(self):
+        result = check_urls.check_url(f"{self.base}/redirect", 5)
+        self.assertTrue(result["ok"])
+        self.assertEqual(result["size"], 1234)
+        self.assertEqual(StubHandler.requests, [("HEAD", "/redirect", None), ("HEAD", "/file", None)])
+
+    def test_ranged_get_fallback(self):
+        result = check_urls.check_url(f"{self.base}/no-head", 5)
+        self.assertTrue(result["ok"])
+        self.assertEqual(result["size"], 999)
+        self.assertEqual(StubHandler.requests[-1], ("GET", "/no-head", "bytes=0-0"))
+
+    def test_unreachable(self):
+        result = check_urls.check_url(f"{self.base}/missing", 5)
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["status"], 404)
+
+    def test_check_urls_keeps_sources(self):
+        results = check_urls.check_urls({f"{self.base}/file": ["a"], f"{self.base}/missing": ["b", "c"]}, 4, 2, timeout=5)
+        self.assertEqual(results[f"{self.base}/file"]["sources"], ["a"])
+        self.assertEqual(results[f"{self.base}/missing"]["sources"], ["b", "c"])
+
+    def check_pack(self, lock_data: dict, exclusions: list[str]) -> dict:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pack_dir = Path(tmpdir)
+            (pack_dir / "mods").mkdir()
+            (pack_dir / "mods" / "lib.pw.toml").write_text(f'filename = "lib.jar"\n[download]\nurl = "{self.base}/file"\n')
+            urls = check_urls.collect_urls(lock_data, pack_dir, exclusions)
+        return check_urls.check_urls(urls, 4, 2, timeout=5)
+
+    def test_excluded_submission_is_skipped(self):
+        lock_data = {
+            "a": {"files": {"a.pw.toml": {"download": {"url": f"{self.base}/file?a"}}}},
+            "b": {"files": {"b.pw.toml": {"download": {"url": f"{self.base}/missing"}}}},
+        }
+        results = self.check_pack(lock_data, ["b"])
+        self.assertNotIn(f"{self.base}/missing", results)
+        self.assertTrue(all(r["ok"] for r in results.values()))
+        self.assertNotIn(("HEAD", "/missing", None), StubHandler.requests)
+
+    def test_file_overridden_by_pack_is_skipped(self):
+        lock_data = {
+            "a": {"files": {
+                "a.pw.toml": {"download": {"url": f"{self.base}/file?a"}},
+                "lib.pw.toml": {"download": {"url": f"{self.base}/missing"}},
+            }},
+        }
+        results = self.check_pack(lock_data, [])
+        self.assertNotIn(f"{self.base}/missing", results)
+        self.assertEqual(results[f"{self.base}/file"]["sources"], ["mods/lib.pw.toml"])
+        self.assertEqual(sum(r["size"] or 0 for r in results.values()), 2 * 1234)
+
+
+if __name__ == "__main__":
+    unittest.main()